@@ -12,12 +12,14 @@ from copy import copy
 import asyncio
 import argparse
 from pathlib import Path
+from contextlib import nullcontext
 from abc import ABC, abstractmethod
 from monstr.client.client import ClientPool, Client
 from monstr.client.event_handlers import EventHandler
 from monstr.event.event import Event
 from util import ConfigError, post_hex_tx_api, sendrawtransaction_bitcoind, get_event_network, is_valid_tx,\
     BLOCKSTREAM_URL_MAP, MEMPOOL_URL_MAP, load_toml
+from profiler import Profiler, check_out_dir, PROFILE_MODES, DEFAULT_PROFILE_MODE
 
 # options can be in this file rather than given at command line
 CONFIG_FILE = f'{Path.home()}/.nostrpy/tx_broadcaster.toml'
@@ -31,6 +33,9 @@ DEFAULT_NETWORK = 'any'
 # default service to use broadcasting txs
 DEFAULT_OUTPUT = 'mempool'
 
+# default dir where profiling output is written
+DEFAULT_PROFILE_DIR = '.'
+
 
 class UnsupportedNetwork(Exception):
     pass
@@ -95,20 +100,30 @@ class BitcoindBroadcaster(BroadCaster):
 
 class BroadcasterHandler(EventHandler):
 
-    def __init__(self, broadcaster: BroadCaster, network: str = 'any'):
+    def __init__(self, broadcaster: BroadCaster, network: str = 'any', profiler: Profiler = None):
         self._broadcaster = broadcaster
         self._network = network
+        self._profiler = profiler
 
     def do_event(self, the_client: Client, sub_id, evt: Event):
+        """
+        handles the event via _do_event, timed under this handlers name when profiling
+        """
+        # if profiling, time under our own name as asyncio only sees the clients task
+        timed = nullcontext()
+        if self._profiler:
+            timed = self._profiler.timed(f'BroadcasterHandler::do_event[{self._broadcaster.name}]')
+
+        with timed:
+            self._do_event(evt)
+
+    def _do_event(self, evt: Event):
         """
         checks event contains valid tx hex and a network to broadcast then uses the given broadcasters
         broadcast_hex func
-        :param the_client:
-        :param sub_id:
         :param evt:
         :return:
         """
-
         try:
             # we could default to a network if not network tag but for now ignore
             network = get_event_network(evt)
@@ -130,7 +145,8 @@ class BroadcasterHandler(EventHandler):
 
                 # finally we can attempt to broadcast the tx
                 asyncio.create_task(self._broadcaster.broadcast_hex(tx_hex=tx_hex,
-                                                                    network=network))
+                                                                    network=network),
+                                    name=f'broadcast_hex[{self._broadcaster.name}]')
 
         except (InvalidTxHex, ValueError) as e:
             print(e)
@@ -162,6 +178,17 @@ def get_cmdline_args(args) -> dict:
                         rpc password for bitcoind, required if output bitcoind
                         """)
 
+    parser.add_argument('--profile', action='store_true', default=args['profile'],
+                        help=f"""start with profiling enabled, profiling can also be toggled at runtime by sending
+                        SIGUSR1. Output is written each time profiling stops, default[{args["profile"]}]
+                        """)
+    parser.add_argument('--profile-dir', action='store', default=args['profile_dir'],
+                        help=f'directory profiling output is written to, default[{args["profile_dir"]}]')
+    parser.add_argument('--profile-mode', action='store', default=args['profile_mode'], choices=PROFILE_MODES,
+                        help=f"""sample for stack samples in collapsed format for flame graphs or cprofile for pstats,
+                        default[{args["profile_mode"]}]
+                        """)
+
     parser.add_argument('--debug', action='store_true', help='enable debug output', default=args['debug'])
 
     ret = parser.parse_args()
@@ -186,6 +213,9 @@ def get_args() -> dict:
         'output': DEFAULT_OUTPUT,
         'user': None,
         'password': None,
+        'profile': False,
+        'profile_dir': DEFAULT_PROFILE_DIR,
+        'profile_mode': DEFAULT_PROFILE_MODE,
         'debug': False
     }
 
@@ -207,6 +237,10 @@ def get_args() -> dict:
         if o == 'bitcoind' and (not ret['user'] or not ret['password']):
             raise ConfigError('--user and --password required when output includes bitcoind')
 
+    # profile dir only matters if we're profiling from the start, SIGUSR1 start checks for itself
+    if ret['profile']:
+        check_out_dir(ret['profile_dir'])
+
     ret_out = copy(ret)
     if ret['password']:
         ret_out['password'] = '****'
@@ -231,23 +265,34 @@ async def main(args):
     # output services, can be more then 1
     output = args['output']
 
+    # always installed so profiling can be toggled via SIGUSR1, --profile starts it now
+    profiler = Profiler(name='broadcaster',
+                        out_dir=args['profile_dir'],
+                        mode=args['profile_mode'])
+    profiler.install()
+    if args['profile']:
+        profiler.start()
+
     # create the tx broadcasters, TODO: which ones enabled should be from cmd line
     handlers = []
     if 'mempool' in output:
         handlers.append(
             BroadcasterHandler(APIBroadcaster(name='mempool',
-                                              url_map=MEMPOOL_URL_MAP))
+                                              url_map=MEMPOOL_URL_MAP),
+                               profiler=profiler)
         )
 
     if 'blockstream' in output:
         handlers.append(
             BroadcasterHandler(APIBroadcaster(name='blockstream',
-                                              url_map=BLOCKSTREAM_URL_MAP))
+                                              url_map=BLOCKSTREAM_URL_MAP),
+                               profiler=profiler)
         )
 
     if 'bitcoind' in output:
         handlers.append(BroadcasterHandler(BitcoindBroadcaster(user=user,
-                                                               password=password)))
+                                                               password=password),
+                                           profiler=profiler))
 
     def on_connect(the_client: Client):
         the_client.subscribe(sub_id='btc_txs',
@@ -258,10 +303,14 @@ async def main(args):
     print(f'started listening for bitcoin txs to relay at: {relays} network: {network} ')
     print(f'broadcast via: {output} ')
     # wait listening for events
-    async with ClientPool(clients=relays,
-                          on_connect=on_connect) as c:
-        while True:
-            await asyncio.sleep(0.5)
+    try:
+        async with ClientPool(clients=relays,
+                              on_connect=on_connect) as c:
+            while True:
+                await asyncio.sleep(0.5)
+    finally:
+        # make sure we get output if exiting while profiling
+        profiler.stop()
 
 
 if __name__ == "__main__":
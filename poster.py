@@ -10,6 +10,7 @@ from util import is_valid_tx
 from monstr.client.client import ClientPool
 from util import get_nostr_bitcoin_tx_event, post_hex_tx_api, ConfigError, \
     BLOCKSTREAM_URL_MAP, MEMPOOL_URL_MAP,load_toml
+from profiler import Profiler, check_out_dir, PROFILE_MODES, DEFAULT_PROFILE_MODE
 
 # options can be in this file rather than given at command line
 CONFIG_FILE = f'{Path.home()}/.nostrpy/tx_poster.toml'
@@ -23,6 +24,9 @@ DEFAULT_NETWORK = 'mainnet'
 # default service to use broadcasting txs
 DEFAULT_OUTPUT = 'mempool'
 
+# default dir where profiling output is written
+DEFAULT_PROFILE_DIR = '.'
+
 
 class InvalidTxHex(Exception):
     pass
@@ -61,6 +65,16 @@ def get_cmdline_args(args):
                         help=f"""comma seperated list of outputs to broadcast txs valid values are nostr, mempool, blockstream, or
                         bitcoind - default {args["output"]}
                         """)
+    parser.add_argument('--profile', action='store_true', default=args['profile'],
+                        help=f"""start with profiling enabled, profiling can also be toggled at runtime by sending
+                        SIGUSR1. Output is written each time profiling stops, default [{args["profile"]}]
+                        """)
+    parser.add_argument('--profile-dir', action='store', default=args['profile_dir'],
+                        help=f'directory profiling output is written to, default [{args["profile_dir"]}]')
+    parser.add_argument('--profile-mode', action='store', default=args['profile_mode'], choices=PROFILE_MODES,
+                        help=f"""sample for stack samples in collapsed format for flame graphs or cprofile for pstats,
+                        default [{args["profile_mode"]}]
+                        """)
 
     parser.add_argument('--debug', action='store_true', help='enable debug output')
 
@@ -89,6 +103,9 @@ def get_args() -> dict:
         'file_data': None,
         'dir': None,
         'watch': False,
+        'profile': False,
+        'profile_dir': DEFAULT_PROFILE_DIR,
+        'profile_mode': DEFAULT_PROFILE_MODE,
         'debug': False
     }
 
@@ -148,6 +165,10 @@ def get_args() -> dict:
         if ret['relay'] is None:
             raise ConfigError('output nostr but no relays given!')
 
+    # profile dir only matters if we're profiling from the start, SIGUSR1 start checks for itself
+    if ret['profile']:
+        check_out_dir(ret['profile_dir'])
+
 
     logging.debug(f'new_get_args:: running with options - {ret}')
 
@@ -172,7 +193,8 @@ def get_post_api(api, network: str):
         try:
             to_url = url_map[api][network]
             asyncio.create_task(post_hex_tx_api(to_url=to_url,
-                                                tx_hex=tx_hex))
+                                                tx_hex=tx_hex),
+                                name=f'post_hex_tx_api[{api}]')
         except KeyError as ke:
             logging.info(f'post_tx to {api} - unable to broadcast event err - {ke}')
 
@@ -220,6 +242,14 @@ async def main(args: dict):
     # in combo with dir, watch that dir for new txs
     watch = args['watch']
 
+    # always installed so profiling can be toggled via SIGUSR1, --profile starts it now
+    profiler = Profiler(name='poster',
+                        out_dir=args['profile_dir'],
+                        mode=args['profile_mode'])
+    profiler.install()
+    if args['profile']:
+        profiler.start()
+
     my_posters = {
         'nostr': get_postr_nostr(my_client, network),
         'mempool': get_post_api('mempool', network),
@@ -230,35 +260,40 @@ async def main(args: dict):
     for out_name in args['output']:
         outputs.append(my_posters[out_name])
 
-    # only connect relay if we're outputing via nostrr
-    if 'nostr' in args['output']:
-        asyncio.create_task(my_client.run())
-        await my_client.wait_connect()
-        print('connect to nostr relays')
-
-
-    # posting of any hex supplied as arg
-    if tx_hex:
-        [c_out(tx_hex) for c_out in outputs]
-
-    # filename option, file_data should exist
-    if file_data:
-        [c_out(file_data) for c_out in outputs]
-
-    # any files in this dir
-    if tx_dir:
-        post_files(tx_dir, outputs)
-
-    # if watch then we'll hang around and watch that dir for new *.txn files
-    if watch:
-        print(f'watching for bitcoin transactions at: {tx_dir} output to {args["output"]}')
-        while True:
+    try:
+        # only connect relay if we're outputing via nostrr
+        if 'nostr' in args['output']:
+            asyncio.create_task(my_client.run())
+            await my_client.wait_connect()
+            print('connect to nostr relays')
+
+        # posting of any hex supplied as arg
+        if tx_hex:
+            [c_out(tx_hex) for c_out in outputs]
+
+        # filename option, file_data should exist
+        if file_data:
+            [c_out(file_data) for c_out in outputs]
+
+        # any files in this dir
+        if tx_dir:
+            with profiler.timed('poster::post_files'):
+                post_files(tx_dir, outputs)
+
+        # if watch then we'll hang around and watch that dir for new *.txn files
+        if watch:
+            print(f'watching for bitcoin transactions at: {tx_dir} output to {args["output"]}')
+            while True:
+                await asyncio.sleep(1)
+                with profiler.timed('poster::post_files'):
+                    post_files(tx_dir, outputs)
+
+            # hack so don't exit before we actually manage to send any we're not staying running
+            # better to check notices/sub and see events probably
             await asyncio.sleep(1)
-            post_files(tx_dir, outputs)
-
-        # hack so don't exit before we actually manage to send any we're not staying running
-        # better to check notices/sub and see events probably
-        await asyncio.sleep(1)
+    finally:
+        # make sure we get output if exiting while profiling
+        profiler.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""
+    profiling hooks for broadcaster.py and poster.py
+
+    while running the profiler will, depending on mode, either -
+        sample the event loop thread stack              -> <prefix>-<time>-<pid>-<n>.collapsed
+        cProfile the event loop                         -> <prefix>-<time>-<pid>-<n>.pstats
+    and in both modes
+        record asyncio slow-callback warnings and
+        any timed() handler calls over the threshold    -> <prefix>-<time>-<pid>-<n>.slow.log
+
+    the .collapsed output is in the folded stack format used by flamegraph.pl, speedscope etc.
+    the two aren't run together as from 3.12 cProfile records all threads so would charge the
+    samplers own stack walking to the hot path.
+    profiling can be started at startup (--profile) and/or toggled at runtime by sending SIGUSR1
+    to the process, each time profiling is stopped the output is dumped.
+
+"""
+import logging
+import asyncio
+import signal
+import os
+import sys
+import time
+import tempfile
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from util import ConfigError
+
+# own logger so we never configure the root logger and leave --debug in control of output
+_logger = logging.getLogger(__name__)
+
+# default interval between stack samples in secs
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# callbacks/handlers taking longer than this in secs are recorded as slow
+DEFAULT_SLOW_CALLBACK = 0.05
+
+# what we profile with, stack sampling for flame graphs or cProfile
+PROFILE_MODES = ('sample', 'cprofile')
+DEFAULT_PROFILE_MODE = 'sample'
+
+
+def check_out_dir(out_dir: str):
+    """
+    makes sure we'll be able to write profiling output rather than losing a session at dump
+    :param out_dir: created if it doesn't exist
+    :return:
+    """
+    try:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryFile(dir=out_dir):
+            pass
+    except OSError as e:
+        raise ConfigError(f'profile dir {out_dir} is not writable - {e}')
+
+
+class _SlowCallbackRecorder(logging.Filter):
+    """
+        added to the asyncio logger while profiling, in debug mode asyncio logs
+        'Executing <Handle/Task ...> took x seconds' which includes the callback or task name.
+        As a filter that always passes records asyncio's own output is still handled as normal
+    """
+    def __init__(self, profiler):
+        super().__init__()
+        self._profiler = profiler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        msg = record.getMessage()
+        if msg.startswith('Executing'):
+            self._profiler.add_slow(msg)
+        return True
+
+
+class Profiler:
+    """
+        profiles the event loop, start/stop can be called directly or via toggle which is what
+        the SIGUSR1 handler installed by install() uses
+    """
+    def __init__(self,
+                 name: str,
+                 out_dir: str = '.',
+                 mode: str = DEFAULT_PROFILE_MODE,
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+                 slow_callback: float = DEFAULT_SLOW_CALLBACK):
+        if mode not in PROFILE_MODES:
+            raise ConfigError(f'profile mode {mode} is not one of {PROFILE_MODES}')
+
+        self._name = name
+        self._out_dir = out_dir
+        self._mode = mode
+        self._sample_interval = sample_interval
+        self._slow_callback = slow_callback
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._prev_debug = False
+        self._prev_slow_callback = None
+        self._prev_asyncio_level = logging.NOTSET
+        self._dump_count = 0
+
+        self._running = False
+        self._cprofile = None
+        self._sampler = None
+        self._stacks = Counter()
+        self._slow = []
+        self._slow_recorder = _SlowCallbackRecorder(self)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def install(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        ties the profiler to the loop and installs SIGUSR1 to toggle profiling on/off
+        must be called from the event loop thread
+        :param loop: defaults to the running loop
+        :return:
+        """
+        self._loop = loop if loop else asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        try:
+            self._loop.add_signal_handler(signal.SIGUSR1, self.toggle)
+        except (NotImplementedError, AttributeError) as e:
+            _logger.info(f'Profiler::install - runtime toggle not available on this platform - {e}')
+
+    def toggle(self):
+        if self._running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self._running:
+            return
+        if self._loop is None:
+            self.install()
+
+        # may have become unwritable since startup, don't collect a session we can't output
+        try:
+            check_out_dir(self._out_dir)
+        except ConfigError as ce:
+            _logger.error(f'Profiler::start - not starting - {ce}')
+            return
+
+        self._stacks = Counter()
+        self._slow = []
+
+        # asyncio debug mode gives us the slow-callback warnings
+        self._prev_debug = self._loop.get_debug()
+        self._prev_slow_callback = self._loop.slow_callback_duration
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self._slow_callback
+        asyncio_log = logging.getLogger('asyncio')
+        self._prev_asyncio_level = asyncio_log.level
+        asyncio_log.addFilter(self._slow_recorder)
+        if asyncio_log.getEffectiveLevel() > logging.WARNING:
+            asyncio_log.setLevel(logging.WARNING)
+
+        self._running = True
+        if self._mode == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample,
+                                             name=f'{self._name}-profiler',
+                                             daemon=True)
+            self._sampler.start()
+        print(f'profiling ({self._mode}) started for {self._name}')
+
+    def stop(self) -> list:
+        """
+        stops profiling and dumps output
+        :return: [filenames written]
+        """
+        if not self._running:
+            return []
+
+        self._running = False
+        if self._mode == 'cprofile':
+            self._cprofile.disable()
+        else:
+            self._sampler.join()
+
+        self._loop.set_debug(self._prev_debug)
+        self._loop.slow_callback_duration = self._prev_slow_callback
+        asyncio_log = logging.getLogger('asyncio')
+        asyncio_log.removeFilter(self._slow_recorder)
+        asyncio_log.setLevel(self._prev_asyncio_level)
+
+        # we may be called from a finally on exit so don't raise over the original exit reason
+        try:
+            ret = self._dump()
+        except OSError as e:
+            _logger.error(f'Profiler::stop - unable to write profiling output to {self._out_dir} - {e}')
+            ret = []
+
+        print(f'profiling stopped for {self._name}, output - {ret}')
+        return ret
+
+    def add_slow(self, msg: str):
+        self._slow.append(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {msg}')
+
+    @contextmanager
+    def timed(self, name: str):
+        """
+        times the wrapped block while profiling, recording it as slow if it takes longer than the
+        slow callback threshold. asyncio only sees the task the code ran in so this gives us the
+        actual handler name
+        :param name: recorded name e.g. BroadcasterHandler::do_event[mempool]
+        """
+        if not self._running:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            took = time.perf_counter() - start
+            if took >= self._slow_callback:
+                msg = f'Executing {name} took {took:.3f} seconds'
+                _logger.warning(f'Profiler::timed - {msg}')
+                self.add_slow(msg)
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._stacks[self._collapse(frame)] += 1
+            # drop frame so we're not keeping the loop threads locals alive
+            frame = None
+            time.sleep(self._sample_interval)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        ret = []
+        while frame is not None:
+            code = frame.f_code
+            # co_qualname is 3.11+
+            func = getattr(code, 'co_qualname', code.co_name)
+            ret.append(f'{Path(code.co_filename).stem}:{func}'.replace(';', ':').replace(' ', '_'))
+            frame = frame.f_back
+        ret.reverse()
+        return ';'.join(ret)
+
+    def _dump(self) -> list:
+        ret = []
+        out_dir = Path(self._out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        # pid and count as there may be more than one stop a sec e.g. SIGUSR1 stop then exit
+        self._dump_count += 1
+        prefix = out_dir / f'{self._name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{self._dump_count}'
+
+        if self._mode == 'cprofile':
+            pstats_file = f'{prefix}.pstats'
+            self._cprofile.dump_stats(pstats_file)
+            ret.append(pstats_file)
+        else:
+            collapsed_file = f'{prefix}.collapsed'
+            with open(collapsed_file, 'w') as f:
+                for stack, count in self._stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            ret.append(collapsed_file)
+
+        slow_file = f'{prefix}.slow.log'
+        with open(slow_file, 'w') as f:
+            for msg in self._slow:
+                f.write(f'{msg}\n')
+        ret.append(slow_file)
+
+        return ret